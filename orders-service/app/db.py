@@ -1,9 +1,14 @@
-﻿from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
-from app.settings import settings
+﻿from app.settings import settings
+from app.sharding import ShardRouter
+from app.tracing import instrument_engine
 from sqlalchemy.orm import declarative_base
 
-engine = create_async_engine(
-    settings.DATABASE_URL, 
+# Un engine (y pool) por shard, más sus réplicas de lectura;
+# sin DATABASE_SHARD_URLS todo vive en DATABASE_URL
+router = ShardRouter.from_urls(
+    settings.DATABASE_SHARD_URLS or [settings.DATABASE_URL],
+    replica_urls=settings.DATABASE_REPLICA_URLS,
+    replica_retry_after=settings.REPLICA_RETRY_AFTER_S,
     echo=True, 
     future=True,
     pool_size=15,
@@ -11,9 +16,8 @@ engine = create_async_engine(
     pool_timeout=30,
     pool_recycle=3600
 )
-SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
-Base = declarative_base()
+for _shard in router.shards:
+    for _engine in (_shard.engine, *_shard.replicas.engines):
+        instrument_engine(_engine)
 
-async def get_session() -> AsyncSession:
-    async with SessionLocal() as s:
-        yield s
+Base = declarative_base()
@@ -1,18 +1,57 @@
-﻿from fastapi import FastAPI, Header, HTTPException, Depends
+﻿import json
+import time
+from collections import Counter
+from fastapi import FastAPI, Header, HTTPException, Depends, Request
+from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.exc import IntegrityError
-from app.db import get_session, Base, engine 
+from app.db import Base, router
 from app.models import IdempotencyRequest, IdemStatus, Order, OutboxEvent
-from app.schemas import CreateOrderRequest, AcceptedResponse
-from app.tasks import celery
-from uuid import uuid4
+from app.replicas import is_pinned, pin_to_primary
+from app.responses import model_response, replay_cache
+from app.schemas import (
+    CreateOrderRequest, AcceptedResponse, OrderStatusResponse, RequestStatusResponse, OrdersReportResponse,
+)
+from app.settings import settings
+from app.tasks import celery, build_message
+from app.tracing import tracer, inject, extract
+from uuid import UUID, uuid4
 
 app = FastAPI(title="Orders Service")
 
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    # continúa la traza del cliente si manda `traceparent`
+    with tracer.span(
+        request.method,
+        parent=extract(request.headers),
+        kind="SERVER",
+        attributes={"http.method": request.method, "http.target": request.url.path},
+    ) as span:
+        response = await call_next(request)
+        # nombre por plantilla de ruta (/orders/{order_id}), no por path: pocos nombres distintos
+        route = request.scope.get("route")
+        if route is not None:
+            span.name = f"{request.method} {route.path}"
+            span.set_attribute("http.route", route.path)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
+
 def _sha256(s: str) -> str:
     import hashlib
     return hashlib.sha256(s.encode("utf-8")).hexdigest()
 
+def _key_hash(customer_id: str, idem_key: str) -> str:
+    # La Idempotency-Key se acota al cliente: la misma key enviada por dos clientes son
+    # requests distintas. Así la fila de idempotencia vive siempre en el shard del cliente,
+    # junto a su orden, y el 409 no depende de cómo caigan los clientes en el anillo.
+    return _sha256(json.dumps([customer_id, idem_key]))
+
+def _legacy_key_hash(idem_key: str) -> str:
+    # Formato anterior (key global, sin cliente). Las filas escritas antes del cambio siguen
+    # vigentes: un reintento que cruza el deploy debe encontrar su request, no crear otra orden.
+    return _sha256(idem_key)
+
 def get_idempotency_key(
     idem: str | None = Header(
         default=None,
@@ -24,6 +63,26 @@ def get_idempotency_key(
 ) -> str:
     return idem or str(uuid4())
 
+async def get_order_session(body: CreateOrderRequest) -> AsyncSession:
+    # La orden, su registro de idempotencia y su evento outbox viven en el shard del cliente,
+    # así todo queda en una sola transacción local
+    async with router.shard_for(body.customer_id).sessionmaker() as s:
+        yield s
+
+async def get_read_session(customer_id: str) -> AsyncSession:
+    shard = router.shard_for(customer_id)
+    # read-your-writes: un cliente que acaba de crear una orden lee del primario
+    if await is_pinned(customer_id):
+        async with shard.sessionmaker() as s:
+            yield s
+    else:
+        async with shard.read_session() as s:
+            yield s
+
+def _accepted(key_hash: str, message: str = "Enqueued"):
+    # modelo interno: sin validación, serializado directo con orjson
+    return model_response(AcceptedResponse.model_construct(request_id=key_hash, message=message), 202)
+
 @app.get("/health")
 async def health():
     return {"status": "ok"}
@@ -32,47 +91,121 @@ async def health():
 async def create_order(
     body: CreateOrderRequest,
     Idempotency_Key: str = Depends(get_idempotency_key),
-    session: AsyncSession = Depends(get_session),   
+    session: AsyncSession = Depends(get_order_session),
 ):
-    key_hash = _sha256(Idempotency_Key)
+    key_hash = _key_hash(body.customer_id, Idempotency_Key)
     body_hash = _sha256(body.model_dump_json())
 
-    try:
-        async with session.begin():
+    # replay de una request DONE ya vista: sin tocar la BD
+    cache_key = key_hash
+    cached = replay_cache.get(cache_key)
+    if cached and cached.body_hash == body_hash:
+        return cached.response()
+
+    with tracer.span("create_order.tx", attributes={"key_hash": key_hash}) as span:
+        try:
+            async with session.begin():
+                idem = await session.get(IdempotencyRequest, key_hash)
+                if idem is None and settings.IDEMPOTENCY_LEGACY_KEYS:
+                    legacy = await session.get(IdempotencyRequest, _legacy_key_hash(Idempotency_Key))
+                    if legacy:
+                        # la request sigue con su key_hash original (mismo request_id)
+                        idem = legacy
+                        key_hash = legacy.key_hash
+                        span.set_attribute("key_hash", key_hash)
+                if idem:
+                    if idem.body_hash != body_hash:
+                        raise HTTPException(status_code=409, detail="Idempotency-Key ya usada con payload distinto")
+                    if idem.status == IdemStatus.DONE and idem.response_body:
+                        # se devuelve exactamente lo guardado (status code y body)
+                        return replay_cache.put(
+                            cache_key, body_hash, idem.status_code or 202, idem.response_body
+                        ).response()
+                else:
+                    # Esto puede fallar si otra instancia ya creó el registro
+                    idem = IdempotencyRequest(key_hash=key_hash, body_hash=body_hash, status=IdemStatus.PENDING)
+                    session.add(idem)
+
+                order = Order(customer_id=body.customer_id, items=[i.model_dump() for i in body.items])
+                session.add(order)
+                await session.flush()
+
+                evt = OutboxEvent(
+                    aggregate_id=order.id,
+                    type="OrderCreated",
+                    # traceparent en el payload: quien relea el outbox puede continuar la traza
+                    payload=inject({"order_id": str(order.id), "key_hash": key_hash}),
+                )
+                session.add(evt)
+
+        except IntegrityError:
+            # Otra instancia ya procesó esta request
+            # Buscar el resultado existente
+            await session.rollback()
             idem = await session.get(IdempotencyRequest, key_hash)
-            if idem:
-                if idem.body_hash != body_hash:
-                    raise HTTPException(status_code=409, detail="Idempotency-Key ya usada con payload distinto")
-                if idem.status == IdemStatus.DONE and idem.response_body:
-                    return AcceptedResponse(request_id=key_hash, message="Ya procesado (idempotente)")
-            else:
-                # Esto puede fallar si otra instancia ya creó el registro
-                idem = IdempotencyRequest(key_hash=key_hash, body_hash=body_hash, status=IdemStatus.PENDING)
-                session.add(idem)
-
-            order = Order(customer_id=body.customer_id, items=[i.model_dump() for i in body.items])
-            session.add(order)
-            await session.flush()
-
-            evt = OutboxEvent(
-                aggregate_id=order.id,
-                type="OrderCreated",
-                payload={"order_id": str(order.id), "key_hash": key_hash},
-            )
-            session.add(evt)
-
-    except IntegrityError:
-        # Otra instancia ya procesó esta request
-        # Buscar el resultado existente
-        await session.rollback()
-        idem = await session.get(IdempotencyRequest, key_hash)
-        return AcceptedResponse(request_id=key_hash, message="Ya procesado por otra instancia")
+            return _accepted(key_hash, "Ya procesado por otra instancia")
 
     # fuera de la transacción
-    celery.send_task("process_outbox_event", args=[str(evt.event_id)])
-    return AcceptedResponse(request_id=key_hash)
+    await pin_to_primary(body.customer_id)
+    # el worker necesita saber en qué shard quedó el evento
+    task_kwargs = {"shard": session.info.get("shard")}
+    options = {}
+    if settings.OUTBOX_INLINE_MESSAGES:
+        task_kwargs["message"] = build_message(evt)
+        options["serializer"] = "msgpack"
+    with tracer.span("celery.send_task", kind="PRODUCER", attributes={
+        "messaging.destination": "process_outbox_event",
+        "key_hash": key_hash,
+    }):
+        celery.send_task(
+            "process_outbox_event",
+            args=[str(evt.event_id)],
+            kwargs=task_kwargs,
+            # enqueued_at: el worker calcula cuánto esperó el mensaje en la cola
+            headers=inject({"enqueued_at": time.time()}),
+            **options,
+        )
+    return _accepted(key_hash)
+
+@app.get("/orders/requests/{request_id}", response_model=RequestStatusResponse)
+async def get_request_status(
+    request_id: str,
+    session: AsyncSession = Depends(get_read_session),
+):
+    idem = await session.get(IdempotencyRequest, request_id)
+    if not idem:
+        raise HTTPException(status_code=404, detail="Request no encontrada")
+    return RequestStatusResponse(
+        request_id=idem.key_hash,
+        status=idem.status.value,
+        status_code=idem.status_code,
+        response_body=idem.response_body,
+    )
+
+@app.get("/orders/{order_id}", response_model=OrderStatusResponse)
+async def get_order(
+    order_id: UUID,
+    customer_id: str,
+    session: AsyncSession = Depends(get_read_session),
+):
+    order = await session.get(Order, order_id)
+    if not order or order.customer_id != customer_id:
+        raise HTTPException(status_code=404, detail="Orden no encontrada")
+    return OrderStatusResponse(order_id=str(order.id), customer_id=order.customer_id, status=order.status.value)
+
+@app.get("/reports/orders", response_model=OrdersReportResponse)
+async def orders_report():
+    # reporte: tolera retraso, va a réplicas (reintenta en el primario si una falla)
+    by_status = Counter()
+    async def _count_by_status(s: AsyncSession):
+        res = await s.execute(select(Order.status, func.count()).group_by(Order.status))
+        return res.all()
+
+    for shard in router.shards:
+        for status, n in await shard.read(_count_by_status):
+            by_status[status.value] += n
+    return OrdersReportResponse(by_status=dict(by_status))
 
 @app.on_event("startup")
 async def on_startup():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await router.create_all(Base.metadata)
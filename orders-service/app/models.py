@@ -24,7 +24,7 @@ class Order(Base):
 
 class IdempotencyRequest(Base):
     __tablename__ = "idempotency_requests"
-    key_hash = Column(String, primary_key=True)  # sha256 de la key
+    key_hash = Column(String, primary_key=True)  # sha256 de (customer_id, key)
     body_hash = Column(String, nullable=False)
     status = Column(Enum(IdemStatus), nullable=False, default=IdemStatus.PENDING)
     status_code = Column(Integer, nullable=True)
@@ -0,0 +1,149 @@
+import itertools
+import time
+from contextlib import asynccontextmanager
+
+import redis
+import redis.asyncio as aioredis
+from sqlalchemy.exc import DBAPIError, InterfaceError
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+
+from app.settings import settings
+
+# Segundos que una réplica caída queda fuera de rotación antes de reintentarla
+RETRY_AFTER_S = 30.0
+
+# Errores de conexión/timeout a mitad de una lectura: hablan de la réplica, no de la consulta
+# (PoolTimeoutError: pool de la réplica agotado)
+REPLICA_ERRORS = (InterfaceError, PoolTimeoutError, OSError, TimeoutError)
+
+
+def _is_replica_failure(exc: BaseException) -> bool:
+    # Un DBAPIError cuenta solo si el dialecto lo reconoció como desconexión; un error de
+    # SQL o de esquema (ProgrammingError, "no such table", ...) es de la consulta y se propaga
+    if isinstance(exc, DBAPIError) and exc.connection_invalidated:
+        return True
+    return isinstance(exc, REPLICA_ERRORS)
+
+
+class ReplicaSet:
+    """
+    Réplicas de lectura de un shard. Reparte en round-robin entre las réplicas sanas.
+    - Falla al abrir conexión (o pool agotado): se marca caída y se prueba la siguiente (o el primario).
+    - Se corta la conexión a mitad de la lectura: se marca caída; `session()` propaga el
+      error y `run()` reintenta una vez en el primario. Un error de la consulta no la marca.
+    Una réplica caída sale de rotación `retry_after` segundos.
+    """
+
+    def __init__(
+        self,
+        shard: str,
+        primary: async_sessionmaker,
+        engines: list[AsyncEngine],
+        retry_after: float = RETRY_AFTER_S,
+    ):
+        self.primary = primary
+        self.engines = engines
+        self.sessionmakers = [
+            async_sessionmaker(
+                engine, expire_on_commit=False, class_=AsyncSession, info={"shard": shard, "replica": i}
+            )
+            for i, engine in enumerate(engines)
+        ]
+        self.retry_after = retry_after
+        self._down_until = [0.0] * len(engines)
+        self._rr = itertools.count()
+
+    def healthy(self) -> list[int]:
+        now = time.monotonic()
+        return [i for i, until in enumerate(self._down_until) if until <= now]
+
+    def mark_down(self, idx: int) -> None:
+        self._down_until[idx] = time.monotonic() + self.retry_after
+
+    def _mark_session_down(self, session: AsyncSession) -> None:
+        idx = session.info.get("replica")
+        if idx is not None:
+            self.mark_down(idx)
+
+    def _candidates(self) -> list[int]:
+        up = self.healthy()
+        if not up:
+            return []
+        start = next(self._rr) % len(up)
+        return up[start:] + up[:start]
+
+    @asynccontextmanager
+    async def session(self):
+        session = None
+        for idx in self._candidates():
+            candidate = self.sessionmakers[idx]()
+            try:
+                # fuerza el checkout: con pool_pre_ping una réplica caída falla aquí;
+                # con el pool agotado falla por timeout y también se pasa a la siguiente
+                await candidate.connection()
+            except (DBAPIError, PoolTimeoutError, OSError):
+                await candidate.close()
+                self.mark_down(idx)
+                continue
+            session = candidate
+            break
+        if session is None:
+            session = self.primary()
+        async with session:
+            try:
+                yield session
+            except Exception as exc:
+                if _is_replica_failure(exc):
+                    self._mark_session_down(session)
+                raise
+
+    async def run(self, fn):
+        """Ejecuta `await fn(session)`; si la réplica falla a mitad de la lectura, reintenta en el primario."""
+        async with self.session() as session:
+            try:
+                return await fn(session)
+            except Exception as exc:
+                if "replica" not in session.info or not _is_replica_failure(exc):
+                    raise
+                self._mark_session_down(session)
+        async with self.primary() as session:
+            return await fn(session)
+
+
+# -----------------------------
+# Read-your-writes
+#   Tras crear una orden el cliente queda fijado al primario unos segundos,
+#   así un replay o una consulta inmediata no lee una réplica atrasada.
+# -----------------------------
+_client = None
+
+def _redis() -> aioredis.Redis:
+    global _client
+    if _client is None:
+        # timeouts cortos: un Redis lento o caído no puede frenar las requests
+        _client = aioredis.Redis.from_url(
+            settings.REDIS_URL,
+            decode_responses=True,
+            socket_timeout=settings.REDIS_TIMEOUT_S,
+            socket_connect_timeout=settings.REDIS_TIMEOUT_S,
+        )
+    return _client
+
+def _pin_key(client_id: str) -> str:
+    return f"ryw:{client_id}"
+
+async def pin_to_primary(client_id: str, window: float | None = None) -> None:
+    window = settings.READ_YOUR_WRITES_WINDOW_S if window is None else window
+    try:
+        await _redis().set(_pin_key(client_id), "1", px=int(window * 1000))
+    except (redis.RedisError, OSError):
+        # sin pin, una lectura inmediata puede caer en una réplica atrasada; no bloquea la escritura
+        pass
+
+async def is_pinned(client_id: str) -> bool:
+    try:
+        return bool(await _redis().exists(_pin_key(client_id)))
+    except (redis.RedisError, OSError):
+        # ante la duda se lee del primario
+        return True
@@ -0,0 +1,84 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import orjson
+from fastapi import Response
+from pydantic import BaseModel
+
+from app.settings import settings
+
+JSON = "application/json"
+
+# Overhead aproximado por entrada (clave, tupla, nodo del OrderedDict)
+_ENTRY_OVERHEAD = 200
+
+
+def json_bytes_response(body: bytes, status_code: int) -> Response:
+    return Response(content=body, status_code=status_code, media_type=JSON)
+
+
+def model_response(model: BaseModel, status_code: int) -> Response:
+    """
+    Serializa con orjson un modelo interno ya válido (creado con model_construct).
+    Devolver un Response hace que FastAPI no vuelva a validar contra response_model.
+    """
+    return json_bytes_response(orjson.dumps(model.model_dump()), status_code)
+
+
+@dataclass(frozen=True)
+class CachedReplay:
+    body_hash: str
+    status_code: int
+    body: bytes
+
+    def response(self) -> Response:
+        return json_bytes_response(self.body, self.status_code)
+
+
+class ReplayCache:
+    """
+    LRU de respuestas DONE ya serializadas, acotada por bytes.
+    Una request DONE no cambia más, así que su respuesta se puede reutilizar tal cual.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, CachedReplay] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _cost(key: str, entry: CachedReplay) -> int:
+        return len(key) + len(entry.body) + _ENTRY_OVERHEAD
+
+    def get(self, key_hash: str) -> CachedReplay | None:
+        entry = self._entries.get(key_hash)
+        if entry is not None:
+            self._entries.move_to_end(key_hash)
+        return entry
+
+    def put(self, key_hash: str, body_hash: str, status_code: int, response_body) -> CachedReplay:
+        # response_body guardado como texto JSON se devuelve byte a byte, sin re-serializar
+        body = response_body.encode("utf-8") if isinstance(response_body, str) else orjson.dumps(response_body)
+        entry = CachedReplay(body_hash=body_hash, status_code=status_code, body=body)
+        cost = self._cost(key_hash, entry)
+        if cost > self.max_bytes:
+            return entry  # demasiado grande para cachear, se responde igual
+        old = self._entries.pop(key_hash, None)
+        if old is not None:
+            self.size -= self._cost(key_hash, old)
+        self._entries[key_hash] = entry
+        self.size += cost
+        while self.size > self.max_bytes:
+            k, evicted = self._entries.popitem(last=False)
+            self.size -= self._cost(k, evicted)
+        return entry
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self.size = 0
+
+
+replay_cache = ReplayCache(settings.REPLAY_CACHE_MAX_BYTES)
@@ -1,5 +1,5 @@
 ﻿from pydantic import BaseModel, Field
-from typing import List
+from typing import Any, Dict, List, Optional
 
 class OrderItem(BaseModel):
     sku: str
@@ -16,3 +16,17 @@ class AcceptedResponse(BaseModel):
 class CreatedOrderResponse(BaseModel):
     order_id: str
     status: str = "CREATED"
+
+class OrderStatusResponse(BaseModel):
+    order_id: str
+    customer_id: str
+    status: str
+
+class RequestStatusResponse(BaseModel):
+    request_id: str
+    status: str
+    status_code: Optional[int] = None
+    response_body: Optional[Any] = None
+
+class OrdersReportResponse(BaseModel):
+    by_status: Dict[str, int]
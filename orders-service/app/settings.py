@@ -2,9 +2,31 @@
 
 class Settings(BaseSettings):
     DATABASE_URL: str = "postgresql+asyncpg://postgres:postgres@db:5432/orders"
+    # Shards (JSON en el .env, ej: '["postgresql+asyncpg://...a", "postgresql+asyncpg://...b"]')
+    # Vacío = un único shard en DATABASE_URL
+    DATABASE_SHARD_URLS: list[str] = []
+    # Réplicas de lectura por shard (JSON), ej: '{"shard0": ["postgresql+asyncpg://...replica"]}'
+    DATABASE_REPLICA_URLS: dict[str, list[str]] = {}
+    REPLICA_RETRY_AFTER_S: float = 30.0        # réplica caída fuera de rotación
+    READ_YOUR_WRITES_WINDOW_S: float = 5.0     # cliente fijado al primario tras escribir
     REDIS_URL: str = "redis://redis:6379/0"
+    REDIS_TIMEOUT_S: float = 0.05              # connect/lectura para los pins read-your-writes
     CELERY_BROKER_URL: str = "redis://redis:6379/0"    # usa literal; el .env puede sobreescribir
     CELERY_RESULT_BACKEND: str = "redis://redis:6379/0"
+    # Mensajes autocontenidos (msgpack): el worker no relee outbox/orden/idempotencia
+    OUTBOX_INLINE_MESSAGES: bool = False
+
+    # Idempotency-Key acotada por cliente; también se buscan filas con el formato anterior
+    # (sha256 de la key sola). Se puede apagar cuando la retención ya purgó esas filas.
+    IDEMPOTENCY_LEGACY_KEYS: bool = True
+
+    # Respuestas de replay (DONE) ya serializadas en memoria, por proceso
+    REPLAY_CACHE_MAX_BYTES: int = 8 * 1024 * 1024
+
+    # Trazas: "none" | "memory" | "file"
+    TRACING_EXPORTER: str = "none"
+    TRACING_FILE: str = "traces.jsonl"
+    TRACING_SAMPLE_RATIO: float = 1.0
 
     model_config = SettingsConfigDict(
         env_file=".env",
@@ -0,0 +1,107 @@
+import bisect
+import hashlib
+from dataclasses import dataclass
+
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+
+from app.replicas import RETRY_AFTER_S, ReplicaSet
+
+# Nodos virtuales por shard: suavizan el reparto de claves en el anillo
+VNODES = 64
+
+
+def _ring_hash(value: str) -> int:
+    return int.from_bytes(hashlib.sha256(value.encode("utf-8")).digest()[:8], "big")
+
+
+@dataclass
+class Shard:
+    name: str
+    engine: AsyncEngine
+    sessionmaker: async_sessionmaker
+    replicas: ReplicaSet
+
+    def read_session(self):
+        """Sesión para lecturas que toleran algo de retraso (réplica sana o, si no hay, primario)."""
+        return self.replicas.session()
+
+    async def read(self, fn):
+        """Ejecuta `await fn(session)` en una réplica, con reintento en el primario si falla."""
+        return await self.replicas.run(fn)
+
+
+class ShardRouter:
+    """
+    Enruta una clave (customer_id, key_hash, ...) a un shard mediante hashing consistente.
+    Cada shard tiene su propio engine y pool; agregar un shard solo mueve ~1/N de las claves.
+    Las réplicas de lectura son opcionales y se indican por nombre de shard.
+    """
+
+    def __init__(
+        self,
+        engines: dict[str, AsyncEngine],
+        replicas: dict[str, list[AsyncEngine]] | None = None,
+        vnodes: int = VNODES,
+        replica_retry_after: float = RETRY_AFTER_S,
+    ):
+        if not engines:
+            raise ValueError("ShardRouter necesita al menos un engine")
+        replicas = replicas or {}
+        unknown = set(replicas) - set(engines)
+        if unknown:
+            raise ValueError(f"Réplicas para shards desconocidos: {sorted(unknown)}")
+        self.shards = []
+        for name, engine in engines.items():
+            primary = async_sessionmaker(
+                engine, expire_on_commit=False, class_=AsyncSession, info={"shard": name}
+            )
+            self.shards.append(Shard(
+                name=name,
+                engine=engine,
+                sessionmaker=primary,
+                replicas=ReplicaSet(name, primary, replicas.get(name, []), retry_after=replica_retry_after),
+            ))
+        self._by_name = {s.name: s for s in self.shards}
+        ring = sorted(
+            (_ring_hash(f"{s.name}#{i}"), s.name) for s in self.shards for i in range(vnodes)
+        )
+        self._ring_keys = [h for h, _ in ring]
+        self._ring_names = [n for _, n in ring]
+
+    @classmethod
+    def from_urls(
+        cls,
+        urls: list[str],
+        replica_urls: dict[str, list[str]] | None = None,
+        replica_retry_after: float = RETRY_AFTER_S,
+        **engine_kwargs,
+    ) -> "ShardRouter":
+        # El nombre depende de la posición: agregar URLs al final no renombra los shards existentes
+        engines = {f"shard{i}": create_async_engine(url, **engine_kwargs) for i, url in enumerate(urls)}
+        # pre_ping: una réplica caída se detecta al tomar la conexión y dispara el failover
+        replicas = {
+            name: [create_async_engine(url, pool_pre_ping=True, **engine_kwargs) for url in r_urls]
+            for name, r_urls in (replica_urls or {}).items()
+        }
+        return cls(engines, replicas, replica_retry_after=replica_retry_after)
+
+    def shard_for(self, routing_key: str) -> Shard:
+        idx = bisect.bisect(self._ring_keys, _ring_hash(routing_key)) % len(self._ring_keys)
+        return self._by_name[self._ring_names[idx]]
+
+    def get(self, name: str) -> Shard:
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise KeyError(f"Shard desconocido: {name}") from None
+
+    async def create_all(self, metadata) -> None:
+        for s in self.shards:
+            async with s.engine.begin() as conn:
+                await conn.run_sync(metadata.create_all)
+
+    async def dispose(self) -> None:
+        for s in self.shards:
+            await s.engine.dispose()
+            for replica in s.replicas.engines:
+                await replica.dispose()
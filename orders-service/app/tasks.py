@@ -1,26 +1,64 @@
 ﻿import asyncio
+import time
 from uuid import UUID
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 from celery import Celery
+from sqlalchemy import select, func, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.settings import settings
-from app.db import SessionLocal
+from app.db import router
 from app.models import OutboxEvent, Order, OrderStatus, IdempotencyRequest, IdemStatus
+from app.tracing import tracer, current_span, extract
 
 celery = Celery(__name__,
                 broker=settings.CELERY_BROKER_URL,
                 backend=settings.CELERY_RESULT_BACKEND)
+# msgpack para los mensajes autocontenidos del outbox; json sigue siendo el default
+celery.conf.accept_content = ["json", "msgpack"]
 
-@celery.task(name="process_outbox_event", max_retries=5, default_retry_delay=5)
-def process_outbox_event(event_id: str):
-    asyncio.run(_process(event_id))
+# Versión del formato de mensaje autocontenido; si no coincide el worker relee la BD
+MESSAGE_VERSION = 1
 
-async def _process(event_id: str):
-    async with SessionLocal() as session:  # type: AsyncSession
+def build_message(evt: OutboxEvent) -> dict:
+    """Lo que el worker necesita para procesar el evento sin leer la BD."""
+    return {
+        "v": MESSAGE_VERSION,
+        "aggregate_id": str(evt.aggregate_id),
+        "key_hash": evt.payload["key_hash"],
+        "payload": evt.payload,
+    }
+
+def _message_headers(request) -> dict:
+    # protocolo 2 de Celery: los headers propios llegan como atributos del request
+    headers = dict(getattr(request, "headers", None) or {})
+    for key in ("traceparent", "enqueued_at"):
+        value = getattr(request, key, None)
+        if value is not None:
+            headers.setdefault(key, value)
+    return headers
+
+# fire-and-forget: el resultado vive en la BD (idempotency_requests), no en el result backend
+@celery.task(name="process_outbox_event", bind=True, max_retries=5, default_retry_delay=5, ignore_result=True)
+def process_outbox_event(self, event_id: str, shard: str | None = None, message: dict | None = None):
+    headers = _message_headers(self.request)
+    attributes = {"messaging.event_id": event_id}
+    if headers.get("enqueued_at") is not None:
+        attributes["messaging.queue_time_ms"] = round((time.time() - float(headers["enqueued_at"])) * 1000, 3)
+    with tracer.span("process_outbox_event", parent=extract(headers), kind="CONSUMER", attributes=attributes):
+        asyncio.run(_process(event_id, shard, message))
+
+async def _process(event_id: str, shard: str | None = None, message: dict | None = None):
+    # Sin shard (mensajes previos al sharding) se usa el shard por defecto
+    Session = (router.get(shard) if shard else router.shards[0]).sessionmaker
+    async with Session() as session:  # type: AsyncSession
         # Empieza una transacción explícita
         async with session.begin():
+            if message and message.get("v") == MESSAGE_VERSION:
+                await _process_inline(session, event_id, message)
+                return
+
             evt = await session.get(OutboxEvent, UUID(event_id))
             if not evt:
                 return
@@ -34,9 +72,76 @@ async def _process(event_id: str):
             evt.published_at = datetime.now(timezone.utc)
 
             key_hash = evt.payload["key_hash"]
+            span = current_span()
+            if span:
+                span.set_attribute("key_hash", key_hash)
+                # si el mensaje llegó sin headers de traza, al menos queda enlazado con la del outbox
+                origin = extract(evt.payload)
+                if origin and origin.trace_id != span.context.trace_id:
+                    span.add_link(origin)
             idem = await session.get(IdempotencyRequest, key_hash)
             if idem and idem.status != IdemStatus.DONE:
                 idem.status = IdemStatus.DONE
                 idem.status_code = 201
                 idem.response_body = {"order_id": str(order.id), "status": "CREATED"}
         # session.commit() lo hace el context manager de begin()
+
+async def _process_inline(session: AsyncSession, event_id: str, message: dict):
+    """
+    Camino sin lecturas: el mensaje trae aggregate_id y key_hash, así que basta con
+    UPDATEs condicionales. Si la orden ya no está en NEW (reentrega) no se toca nada.
+    """
+    order_id = UUID(message["aggregate_id"])
+    key_hash = message["key_hash"]
+    span = current_span()
+    if span:
+        span.set_attribute("key_hash", key_hash)
+        span.set_attribute("outbox.inline_message", True)
+
+    res = await session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == OrderStatus.NEW)
+        .values(status=OrderStatus.CREATED)
+    )
+    if res.rowcount == 0:
+        return
+
+    await session.execute(
+        update(OutboxEvent)
+        .where(OutboxEvent.event_id == UUID(event_id), OutboxEvent.published_at.is_(None))
+        .values(published_at=datetime.now(timezone.utc))
+    )
+    await session.execute(
+        update(IdempotencyRequest)
+        .where(IdempotencyRequest.key_hash == key_hash, IdempotencyRequest.status != IdemStatus.DONE)
+        .values(
+            status=IdemStatus.DONE,
+            status_code=201,
+            response_body={"order_id": str(order_id), "status": "CREATED"},
+        )
+    )
+
+@celery.task(name="retention_dry_run")
+def retention_dry_run(older_than_days: int = 30) -> dict:
+    return asyncio.run(_retention_dry_run(older_than_days))
+
+async def _retention_dry_run(older_than_days: int) -> dict:
+    """Cuenta por shard lo que una purga borraría. Solo lectura: va a réplicas."""
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+
+    async def _count(session: AsyncSession) -> dict:
+        idem = await session.scalar(
+            select(func.count()).select_from(IdempotencyRequest).where(
+                IdempotencyRequest.status == IdemStatus.DONE,
+                IdempotencyRequest.updated_at < cutoff,
+            )
+        )
+        outbox = await session.scalar(
+            select(func.count()).select_from(OutboxEvent).where(
+                OutboxEvent.published_at.is_not(None),
+                OutboxEvent.published_at < cutoff,
+            )
+        )
+        return {"idempotency_requests": idem, "outbox_events": outbox}
+
+    return {shard.name: await shard.read(_count) for shard in router.shards}
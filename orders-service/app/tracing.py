@@ -0,0 +1,306 @@
+# Trazas estilo OpenTelemetry (sin dependencia externa)
+#   - Contexto W3C `traceparent` para seguir la traza API -> outbox -> Celery -> worker
+#   - Muestreo por ratio sobre el trace_id (un hijo hereda la decisión del padre)
+#   - Exportadores: memoria (tests) y archivo JSON lines (local)
+import atexit
+import contextvars
+import json
+import os
+import queue
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+from sqlalchemy import event
+
+from app.settings import settings
+
+_current: contextvars.ContextVar["Span | None"] = contextvars.ContextVar("current_span", default=None)
+
+
+@dataclass(frozen=True)
+class SpanContext:
+    trace_id: str   # 32 hex
+    span_id: str    # 16 hex
+    sampled: bool
+
+
+class Span:
+    def __init__(self, tracer, name: str, context: SpanContext, parent_id: str | None,
+                 kind: str = "INTERNAL", attributes: dict | None = None):
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.links: list[SpanContext] = []
+        self.status = "OK"
+        self.error: str | None = None
+        self.start_ns = time.time_ns()
+        self.end_ns: int | None = None
+
+    @property
+    def recording(self) -> bool:
+        return self.context.sampled
+
+    def set_attribute(self, key: str, value) -> None:
+        if self.recording:
+            self.attributes[key] = value
+
+    def add_link(self, context: SpanContext | None) -> None:
+        if context and self.recording:
+            self.links.append(context)
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = "ERROR"
+        self.error = f"{type(exc).__name__}: {exc}"
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.recording and self.tracer.exporter is not None:
+            self.tracer.exporter.export(self)
+
+    @property
+    def duration_ms(self) -> float:
+        return ((self.end_ns or time.time_ns()) - self.start_ns) / 1e6
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.context.trace_id,
+            "span_id": self.context.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+            "links": [{"trace_id": l.trace_id, "span_id": l.span_id} for l in self.links],
+        }
+
+
+# -----------------------------
+# Exportadores
+# -----------------------------
+_STOP = object()   # centinela para cerrar el hilo del FileExporter
+
+class InMemoryExporter:
+    def __init__(self):
+        self.spans: list[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+    def by_name(self, name: str) -> list[Span]:
+        return [s for s in self.spans if s.name == name]
+
+    def clear(self) -> None:
+        self.spans.clear()
+
+
+class FileExporter:
+    """
+    Una línea JSON por span; el worker y la API pueden escribir al mismo archivo.
+    Como un batch span processor: `export` solo encola (no bloquea el event loop) y un
+    hilo de fondo serializa y escribe por lotes. Con la cola llena el span se descarta.
+    Tras un fork (pool prefork de Celery) el hijo no hereda el hilo: arranca cola e hilo propios.
+    """
+
+    def __init__(self, path: str, max_queue_size: int = 2048, max_batch_size: int = 512):
+        self.path = path
+        self.max_queue_size = max_queue_size
+        self.max_batch_size = max_batch_size
+        self._closed = False
+        self._start()
+        os.register_at_fork(after_in_child=self._after_fork)
+        atexit.register(self.shutdown)
+
+    def _start(self) -> None:
+        self.dropped = 0
+        self._queue: queue.Queue = queue.Queue(maxsize=self.max_queue_size)
+        self._thread = threading.Thread(target=self._worker, name="trace-file-exporter", daemon=True)
+        self._thread.start()
+
+    def _after_fork(self) -> None:
+        # lo que quedó en la copia de la cola lo escribe el padre; el hijo empieza de cero
+        if not self._closed:
+            self._start()
+
+    def export(self, span: Span) -> None:
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _worker(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            spans = [s for s in batch if s is not _STOP]
+            try:
+                if spans:
+                    lines = "".join(json.dumps(s.to_dict(), default=str) + "\n" for s in spans)
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(lines)
+            except OSError:
+                self.dropped += len(spans)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+            if len(spans) != len(batch):
+                return
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Espera a que lo encolado quede escrito. Devuelve False si venció el timeout."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if time.monotonic() >= deadline or not self._thread.is_alive():
+                return False
+            time.sleep(0.005)
+        return True
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        self._closed = True
+        if not self._thread.is_alive():
+            return
+        self.flush(timeout)
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+
+# -----------------------------
+# Tracer
+# -----------------------------
+class Tracer:
+    def __init__(self, exporter=None, sample_ratio: float = 1.0):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+
+    def _should_sample(self, trace_id: str) -> bool:
+        # determinista por trace_id: todos los procesos deciden igual
+        return int(trace_id[:16], 16) < self.sample_ratio * 2**64
+
+    def start_span(self, name: str, parent: SpanContext | None = None,
+                   kind: str = "INTERNAL", attributes: dict | None = None) -> Span:
+        if parent is None:
+            current = _current.get()
+            parent = current.context if current else None
+        if parent is None:
+            trace_id = secrets.token_hex(16)
+            sampled = self._should_sample(trace_id)
+            parent_id = None
+        else:
+            trace_id, sampled, parent_id = parent.trace_id, parent.sampled, parent.span_id
+        ctx = SpanContext(trace_id=trace_id, span_id=secrets.token_hex(8), sampled=sampled)
+        return Span(self, name, ctx, parent_id, kind=kind, attributes=attributes)
+
+    @contextmanager
+    def span(self, name: str, parent: SpanContext | None = None,
+             kind: str = "INTERNAL", attributes: dict | None = None):
+        """Abre un span, lo deja como actual y lo cierra (marcando error si hubo excepción)."""
+        span = self.start_span(name, parent=parent, kind=kind, attributes=attributes)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.record_exception(exc)
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+
+def current_span() -> Span | None:
+    return _current.get()
+
+
+# -----------------------------
+# Propagación W3C traceparent
+# -----------------------------
+def inject(carrier: dict | None = None) -> dict:
+    carrier = {} if carrier is None else carrier
+    span = _current.get()
+    if span:
+        ctx = span.context
+        carrier["traceparent"] = f"00-{ctx.trace_id}-{ctx.span_id}-{'01' if ctx.sampled else '00'}"
+    return carrier
+
+
+def extract(carrier: dict | None) -> SpanContext | None:
+    value = (carrier or {}).get("traceparent")
+    if not value:
+        return None
+    parts = value.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return SpanContext(trace_id=parts[1], span_id=parts[2], sampled=parts[3] == "01")
+
+
+# -----------------------------
+# Instrumentación de SQLAlchemy: un span por sentencia
+# -----------------------------
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is None:
+        return  # sentencias fuera de una traza (startup, scripts) no se registran
+    span = tracer.start_span("db.statement", kind="CLIENT", attributes={
+        "db.system": conn.dialect.name,
+        "db.name": conn.engine.url.database,
+        "db.statement": statement[:500],
+    })
+    if executemany:
+        span.set_attribute("db.batch_size", len(parameters))
+    context._trace_span = span
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    span = getattr(context, "_trace_span", None)
+    if span:
+        span.set_attribute("db.rowcount", cursor.rowcount)
+        span.end()
+
+def _handle_error(exception_context):
+    span = getattr(exception_context.execution_context, "_trace_span", None)
+    if span:
+        span.record_exception(exception_context.original_exception)
+        span.end()
+
+def instrument_engine(engine) -> None:
+    sync_engine = getattr(engine, "sync_engine", engine)
+    if event.contains(sync_engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(sync_engine, "handle_error", _handle_error)
+
+def uninstrument_engine(engine) -> None:
+    sync_engine = getattr(engine, "sync_engine", engine)
+    for name, fn in (
+        ("before_cursor_execute", _before_cursor_execute),
+        ("after_cursor_execute", _after_cursor_execute),
+        ("handle_error", _handle_error),
+    ):
+        if event.contains(sync_engine, name, fn):
+            event.remove(sync_engine, name, fn)
+
+
+def _exporter_from_settings():
+    if settings.TRACING_EXPORTER == "memory":
+        return InMemoryExporter()
+    if settings.TRACING_EXPORTER == "file":
+        return FileExporter(settings.TRACING_FILE)
+    return None
+
+tracer = Tracer(exporter=_exporter_from_settings(), sample_ratio=settings.TRACING_SAMPLE_RATIO)
@@ -1,9 +1,8 @@
 ﻿import asyncio
-from app.db import engine
+from app.db import router
 from app.models import Base
 
 async def main():
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    await router.create_all(Base.metadata)
 
 asyncio.run(main())
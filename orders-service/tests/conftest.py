@@ -5,8 +5,8 @@ from fastapi.testclient import TestClient
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 
 from app.main import app as fastapi_app
-from app.db import get_session
 from app.models import Base
+from app.sharding import ShardRouter
 
 # -----------------------------
 # TestClient con lifespan real
@@ -14,16 +14,9 @@ from app.models import Base
 @pytest.fixture()
 def client(test_engine, monkeypatch):
     """
-    TestClient con lifespan + engine parcheado a SQLite en memoria.
-    Evita conexiones a Postgres durante el on_startup.
+    TestClient con lifespan; el router ya apunta al engine SQLite en memoria (override_db),
+    así el on_startup no conecta a Postgres.
     """
-    import app.main as main_mod
-    import app.db as db_mod
-
-    # Parchar ambos módulos a usar el engine de pruebas
-    monkeypatch.setattr(main_mod, "engine", test_engine, raising=True)
-    monkeypatch.setattr(db_mod, "engine", test_engine, raising=True)
-
     # Lifespan activo para que cuenten líneas de startup/shutdown en cobertura
     with TestClient(fastapi_app) as c:
         yield c
@@ -53,27 +46,16 @@ async def test_session(test_engine):
             await s.rollback()
 
 # -----------------------------
-# OVERRIDE por REQUEST (clave)
-#   - Crea una AsyncSession NUEVA por request del cliente
-#   - No reutiliza test_session
+# Router de shards de pruebas (clave)
+#   - API y worker resuelven sus sesiones vía el router: un único shard sobre el engine de pruebas
+#   - Cada request abre una AsyncSession NUEVA; no reutiliza test_session
 # -----------------------------
 @pytest.fixture(autouse=True)
 def override_db(test_engine, monkeypatch):
-    Session = async_sessionmaker(test_engine, expire_on_commit=False, class_=AsyncSession)
-
-    async def _override():
-        async with Session() as s:
-            yield s
-
-    # FastAPI Depends(...)
-    fastapi_app.dependency_overrides[get_session] = _override
-
-    # Si algún módulo importa app.db.get_session directamente, lo forzamos también
-    dbmod = importlib.import_module("app.db")
-    monkeypatch.setattr(dbmod, "get_session", _override)
-
-    yield
-    fastapi_app.dependency_overrides.clear()
+    router = ShardRouter({"shard0": test_engine})
+    for name in ("app.db", "app.main", "app.tasks"):
+        monkeypatch.setattr(importlib.import_module(name), "router", router, raising=True)
+    return router
 
 # -----------------------------
 # Redis falso
@@ -81,8 +63,14 @@ def override_db(test_engine, monkeypatch):
 @pytest.fixture(autouse=True)
 def fake_redis(monkeypatch):
     import fakeredis, redis
-    r = fakeredis.FakeRedis(decode_responses=True)
+    server = fakeredis.FakeServer()
+    r = fakeredis.FakeRedis(server=server, decode_responses=True)
     monkeypatch.setattr(redis, "Redis", lambda *a, **k: r)
+    # los pins read-your-writes usan redis.asyncio: mismo servidor falso, así `r` ve sus claves
+    monkeypatch.setattr(
+        importlib.import_module("app.replicas"), "_client",
+        fakeredis.FakeAsyncRedis(server=server, decode_responses=True),
+    )
     return r
 
 # -----------------------------
@@ -3,6 +3,7 @@ import hashlib
 from sqlalchemy import delete
 from app.models import IdempotencyRequest, IdemStatus
 from app.schemas import CreateOrderRequest
+from app.main import _key_hash
 
 def _sha256(s: str) -> str:
     return hashlib.sha256(s.encode()).hexdigest()
@@ -12,9 +13,8 @@ async def test_orders_conflict_same_key_different_payload_returns_409(
     client, test_session, override_db
 ):
     idem_key = "00000000-0000-0000-0000-00000000C0NF-1"
-    key_hash = _sha256(idem_key)
-
     original_body = {"customer_id": "C-ONE", "items": [{"sku": "A", "qty": 1}]}
+    key_hash = _key_hash(original_body["customer_id"], idem_key)
     original_req = CreateOrderRequest(**original_body)
     original_hash = _sha256(original_req.model_dump_json())
 
@@ -34,8 +34,8 @@ async def test_orders_conflict_same_key_different_payload_returns_409(
     test_session.add(idem)
     await test_session.commit()
 
-    # Mismo Idempotency-Key pero payload DIFERENTE -> 409
-    different_body = {"customer_id": "C-OTHER", "items": [{"sku": "B", "qty": 2}]}
+    # Mismo cliente y mismo Idempotency-Key pero payload DIFERENTE -> 409
+    different_body = {"customer_id": "C-ONE", "items": [{"sku": "B", "qty": 2}]}
     r = client.post("/orders", headers={"Idempotency-Key": idem_key}, json=different_body)
     assert r.status_code == 409
     assert r.json()["detail"] == "Idempotency-Key ya usada con payload distinto"
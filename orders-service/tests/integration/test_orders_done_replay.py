@@ -5,6 +5,7 @@ import pytest
 from sqlalchemy import select, func, delete
 from app.models import IdempotencyRequest, IdemStatus, Order, OutboxEvent
 from app.schemas import CreateOrderRequest   # <-- NUEVO
+from app.main import _key_hash
 
 def _sha256(s: str) -> str:
     return hashlib.sha256(s.encode()).hexdigest()
@@ -21,7 +22,7 @@ async def test_orders_replay_done_returns_cached_and_no_side_effects(
 
     # usa un key único para este test (o cambia el sufijo)
     idem_key = "00000000-0000-0000-0000-00000000D0NE-1"
-    key_hash = _sha256(idem_key)
+    key_hash = _key_hash(body["customer_id"], idem_key)
 
     # hashea igual que el endpoint
     req_model = CreateOrderRequest(**body)
@@ -1,8 +1,8 @@
 # tests/integration/test_orders_happy.py
-import app.db as db
+import app.main as main
 from fastapi.testclient import TestClient
 from sqlalchemy import select
-from app.main import app, _sha256
+from app.main import app, _key_hash
 from app.models import IdempotencyRequest, OutboxEvent, Order
 
 client = TestClient(app)
@@ -14,12 +14,12 @@ def test_orders_happy_creates_rows_and_enqueues():
     r = client.post("/orders", headers={"Idempotency-Key": idem_key}, json=body)
     assert r.status_code in (200, 201, 202)
     data = r.json()
-    key_hash = _sha256(idem_key)
+    key_hash = _key_hash(body["customer_id"], idem_key)
     assert data["request_id"] == key_hash
 
     async def _check():
         # 1) Existe el registro de idempotencia
-        async for s in db.get_session():
+        async with main.router.shards[0].sessionmaker() as s:
             idem = await s.get(IdempotencyRequest, key_hash)
             assert idem is not None
             assert idem.status.name in ("PENDING", "DONE")
@@ -40,5 +40,4 @@ def test_orders_happy_creates_rows_and_enqueues():
     asyncio.get_event_loop().run_until_complete(_check())
 
     # 4) Se “envió” la tarea a Celery (dummy del conftest)
-    from app import main
     assert any(c[0] == "process_outbox_event" for c in main.celery.calls)
@@ -1,16 +1,13 @@
 import json
-import hashlib
+import uuid
 import pytest
 from sqlalchemy import select, func, delete
 
-from app.main import create_order, _sha256   # llamamos la función directamente
+from app.main import create_order, _sha256, _key_hash, _legacy_key_hash   # llamamos la función directamente
 from app.models import IdempotencyRequest, IdemStatus, Order, OutboxEvent
 from app.schemas import CreateOrderRequest
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
-def h(s: str) -> str:
-    return hashlib.sha256(s.encode()).hexdigest()
-
 async def _count(session, model):
     from sqlalchemy import select, func
     res = await session.execute(select(func.count()).select_from(model))
@@ -23,7 +20,7 @@ async def test_direct_pending_same_body_enters_try_and_creates_order(test_sessio
     body_hash = _sha256(req.model_dump_json())
 
     idem_key = "00000000-0000-0000-0000-00000000PEND-DIR"
-    key_hash = h(idem_key)
+    key_hash = _key_hash(body["customer_id"], idem_key)
 
     await test_session.execute(
         delete(IdempotencyRequest).where(IdempotencyRequest.key_hash == key_hash)
@@ -55,7 +52,8 @@ async def test_direct_pending_same_body_enters_try_and_creates_order(test_sessio
             session=fresh_session,
         )
 
-    assert resp.request_id == key_hash
+    assert resp.status_code == 202
+    assert json.loads(resp.body)["request_id"] == key_hash
 
     after_o = await _count(test_session, Order)
     after_e = await _count(test_session, OutboxEvent)
@@ -73,7 +71,7 @@ async def test_direct_done_returns_cached_early_return(test_session, monkeypatch
     body_hash = _sha256(req.model_dump_json())
 
     idem_key = "00000000-0000-0000-0000-00000000D0NE-DIR"
-    key_hash = h(idem_key)
+    key_hash = _key_hash(body["customer_id"], idem_key)
     cached = {"request_id": key_hash, "message": "Ya procesado (idempotente)"}
 
     await test_session.execute(delete(IdempotencyRequest).where(IdempotencyRequest.key_hash == key_hash))
@@ -99,9 +97,9 @@ async def test_direct_done_returns_cached_early_return(test_session, monkeypatch
         Idempotency_Key=idem_key,
         session=test_session,
     )
-    assert resp.request_id == key_hash
-    # exactamente la respuesta cacheada
-    assert resp.model_dump() == cached
+    assert resp.status_code == 202
+    # exactamente la respuesta cacheada, byte a byte
+    assert resp.body == json.dumps(cached).encode()
     assert calls["n"] == 0  # no se encola en replay
 
 @pytest.mark.anyio
@@ -110,14 +108,14 @@ async def test_direct_conflict_same_key_different_payload_raises_409(test_sessio
     Cubre: raise HTTPException(409) (línea 46).
     """
     body1 = {"customer_id": "C1", "items": [{"sku": "A", "qty": 1}]}
-    body2 = {"customer_id": "C2", "items": [{"sku": "B", "qty": 2}]}
+    body2 = {"customer_id": "C1", "items": [{"sku": "B", "qty": 2}]}
 
     req1 = CreateOrderRequest(**body1)
     req2 = CreateOrderRequest(**body2)
     bh1 = _sha256(req1.model_dump_json())
 
     idem_key = "00000000-0000-0000-0000-00000000C0NF-DIR"
-    key_hash = h(idem_key)
+    key_hash = _key_hash(body1["customer_id"], idem_key)
 
     await test_session.execute(delete(IdempotencyRequest).where(IdempotencyRequest.key_hash == key_hash))
     await test_session.commit()
@@ -139,3 +137,65 @@ async def test_direct_conflict_same_key_different_payload_raises_409(test_sessio
     # FastAPI levanta HTTPException; en test directo aceptamos cualquier Exception pero
     # comprobamos que el detalle es el esperado.
     assert "Idempotency-Key ya usada con payload distinto" in str(ex.value)
+
+@pytest.mark.anyio
+async def test_direct_legacy_key_hash_keeps_original_request(test_session, monkeypatch):
+    """
+    Filas escritas con el formato anterior (sha256 de la key sola): un reintento
+    después del deploy sigue esa request (mismo request_id) y no crea otra fila de idempotencia.
+    """
+    body = {"customer_id": "C-LEGACY", "items": [{"sku": "L1", "qty": 1}]}
+    req = CreateOrderRequest(**body)
+    idem_key = "00000000-0000-0000-0000-0000000LEGACY"
+    legacy_hash = _legacy_key_hash(idem_key)
+
+    await test_session.execute(delete(IdempotencyRequest).where(IdempotencyRequest.key_hash == legacy_hash))
+    await test_session.commit()
+    test_session.add(IdempotencyRequest(
+        key_hash=legacy_hash, body_hash=_sha256(req.model_dump_json()), status=IdemStatus.PENDING
+    ))
+    await test_session.commit()
+
+    sent = []
+    monkeypatch.setattr("app.main.celery.send_task", lambda *a, **k: sent.append(k["args"][0]), raising=True)
+
+    Session = async_sessionmaker(bind=test_session.bind, expire_on_commit=False, class_=AsyncSession)
+    async with Session() as fresh_session:
+        resp = await create_order(body=req, Idempotency_Key=idem_key, session=fresh_session)
+    assert resp.status_code == 202
+    assert json.loads(resp.body)["request_id"] == legacy_hash
+    assert await test_session.get(IdempotencyRequest, _key_hash(body["customer_id"], idem_key)) is None
+
+    # el worker marca DONE la fila original
+    async with Session() as s:
+        evt = await s.get(OutboxEvent, uuid.UUID(sent[-1]))
+    assert evt.payload["key_hash"] == legacy_hash
+
+    # misma key con otro payload: 409, como antes del cambio
+    other = CreateOrderRequest(customer_id="C-LEGACY", items=[{"sku": "L2", "qty": 1}])
+    async with Session() as fresh_session:
+        with pytest.raises(Exception) as ex:
+            await create_order(body=other, Idempotency_Key=idem_key, session=fresh_session)
+    assert "Idempotency-Key ya usada con payload distinto" in str(ex.value)
+
+@pytest.mark.anyio
+async def test_direct_legacy_lookup_can_be_disabled(test_session, monkeypatch):
+    body = {"customer_id": "C-LEGACY-OFF", "items": [{"sku": "L1", "qty": 1}]}
+    req = CreateOrderRequest(**body)
+    idem_key = "00000000-0000-0000-0000-000000LEGOFF"
+
+    await test_session.execute(delete(IdempotencyRequest).where(IdempotencyRequest.key_hash.in_(
+        [_legacy_key_hash(idem_key), _key_hash(body["customer_id"], idem_key)]
+    )))
+    await test_session.commit()
+    test_session.add(IdempotencyRequest(
+        key_hash=_legacy_key_hash(idem_key), body_hash="otro-body", status=IdemStatus.PENDING
+    ))
+    await test_session.commit()
+
+    monkeypatch.setattr("app.main.settings.IDEMPOTENCY_LEGACY_KEYS", False)
+    monkeypatch.setattr("app.main.celery.send_task", lambda *a, **k: None, raising=True)
+    Session = async_sessionmaker(bind=test_session.bind, expire_on_commit=False, class_=AsyncSession)
+    async with Session() as fresh_session:
+        resp = await create_order(body=req, Idempotency_Key=idem_key, session=fresh_session)
+    assert json.loads(resp.body)["request_id"] == _key_hash(body["customer_id"], idem_key)
@@ -0,0 +1,224 @@
+# tests/unit/test_replicas.py
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import app.main as main
+import app.tasks as tasks
+from app.main import _key_hash
+from app.models import Base
+from app.replicas import is_pinned, pin_to_primary
+from app.sharding import ShardRouter
+
+@pytest.fixture
+async def replicated_router(tmp_path):
+    """Un shard con primario y una réplica vacía (simula una réplica atrasada)."""
+    primary = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'primary.db'}")
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    router = ShardRouter({"shard0": primary}, replicas={"shard0": [replica]})
+    for engine in (primary, replica):
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+    try:
+        yield router
+    finally:
+        await router.dispose()
+
+@pytest.mark.anyio
+async def test_read_session_fails_over_from_dead_replica(test_engine):
+    dead = create_async_engine("sqlite+aiosqlite:////nonexistent-dir/replica.db")
+    router = ShardRouter({"shard0": test_engine}, replicas={"shard0": [dead]})
+    replicas = router.shards[0].replicas
+
+    async with router.shards[0].read_session() as s:
+        assert s.info == {"shard": "shard0"}   # cayó al primario
+    assert replicas.healthy() == []
+
+@pytest.mark.anyio
+async def test_read_session_fails_over_from_exhausted_replica_pool(test_engine, tmp_path):
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+    busy = create_async_engine(
+        f"sqlite+aiosqlite:///{tmp_path / 'busy.db'}",
+        poolclass=AsyncAdaptedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05,
+    )
+    router = ShardRouter({"shard0": test_engine}, replicas={"shard0": [busy]})
+    held = await busy.connect()   # la única conexión del pool queda tomada
+    try:
+        async with router.shards[0].read_session() as s:
+            assert "replica" not in s.info      # pool agotado: cayó al primario
+        assert router.shards[0].replicas.healthy() == []
+    finally:
+        await held.close()
+        await busy.dispose()
+
+@pytest.mark.anyio
+async def test_pin_expires_with_window(fake_redis):
+    await pin_to_primary("C-PIN", window=60)
+    assert await is_pinned("C-PIN")
+    assert not await is_pinned("C-OTHER")
+    assert fake_redis.pttl("ryw:C-PIN") > 0
+
+@pytest.mark.anyio
+async def test_pins_fail_open_when_redis_times_out(monkeypatch):
+    import redis
+    import app.replicas as replicas
+
+    class _SlowRedis:
+        async def set(self, *a, **k):
+            raise redis.TimeoutError("timeout")
+        async def exists(self, *a, **k):
+            raise redis.TimeoutError("timeout")
+
+    monkeypatch.setattr(replicas, "_client", _SlowRedis())
+    await pin_to_primary("C-SLOW")              # no rompe la escritura
+    assert await is_pinned("C-SLOW")            # ante la duda, primario
+
+def test_redis_client_uses_short_timeouts(monkeypatch):
+    import redis.asyncio as aioredis
+    import app.replicas as replicas
+
+    monkeypatch.setattr(replicas, "_client", None)
+    client = replicas._redis()
+    assert isinstance(client, aioredis.Redis)
+    kwargs = client.connection_pool.connection_kwargs
+    assert kwargs["socket_timeout"] == replicas.settings.REDIS_TIMEOUT_S
+    assert kwargs["socket_connect_timeout"] == replicas.settings.REDIS_TIMEOUT_S
+
+def test_read_your_writes_after_create_order(replicated_router, monkeypatch, fake_redis):
+    monkeypatch.setattr(main, "router", replicated_router)
+    client = TestClient(main.app)
+
+    idem_key = str(uuid.uuid4())
+    body = {"customer_id": "C-RYW", "items": [{"sku": "R1", "qty": 1}]}
+    assert client.post("/orders", headers={"Idempotency-Key": idem_key}, json=body).status_code == 202
+
+    # fijado al primario: ve su propia escritura aunque la réplica no la tenga
+    url = f"/orders/requests/{_key_hash('C-RYW', idem_key)}"
+    r = client.get(url, params={"customer_id": "C-RYW"})
+    assert r.status_code == 200
+    assert r.json()["status"] == "PENDING"
+
+    # vencido el pin, la lectura va a la réplica (atrasada)
+    fake_redis.delete("ryw:C-RYW")
+    assert client.get(url, params={"customer_id": "C-RYW"}).status_code == 404
+
+def test_report_and_retention_dry_run_read_replicas(replicated_router, monkeypatch):
+    monkeypatch.setattr(main, "router", replicated_router)
+    monkeypatch.setattr(tasks, "router", replicated_router)
+    client = TestClient(main.app)
+
+    body = {"customer_id": "C-REP", "items": [{"sku": "R2", "qty": 1}]}
+    assert client.post("/orders", json=body).status_code == 202
+
+    # la réplica vacía responde aunque el primario ya tenga la orden
+    assert client.get("/reports/orders").json() == {"by_status": {}}
+    assert tasks.retention_dry_run(0) == {"shard0": {"idempotency_requests": 0, "outbox_events": 0}}
+
+async def _seed_order(engine, customer_id):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+    from app.models import Order
+    order = Order(id=uuid.uuid4(), customer_id=customer_id, items=[{"sku": "G1", "qty": 1}])
+    async with async_sessionmaker(engine, expire_on_commit=False)() as s:
+        s.add(order)
+        await s.commit()
+    return order.id
+
+@pytest.mark.anyio
+async def test_get_order_pinned_reads_primary_unpinned_reads_replica(replicated_router, monkeypatch):
+    monkeypatch.setattr(main, "router", replicated_router)
+    shard = replicated_router.shards[0]
+    in_primary = await _seed_order(shard.engine, "C-GET")
+    in_replica = await _seed_order(shard.replicas.engines[0], "C-GET")
+    client = TestClient(main.app)
+
+    # sin pin: réplica (no ve lo que solo está en el primario)
+    assert client.get(f"/orders/{in_primary}", params={"customer_id": "C-GET"}).status_code == 404
+    r = client.get(f"/orders/{in_replica}", params={"customer_id": "C-GET"})
+    assert r.status_code == 200
+    assert r.json() == {"order_id": str(in_replica), "customer_id": "C-GET", "status": "NEW"}
+
+    # con pin: primario
+    await pin_to_primary("C-GET", window=60)
+    r = client.get(f"/orders/{in_primary}", params={"customer_id": "C-GET"})
+    assert r.status_code == 200
+    assert r.json()["order_id"] == str(in_primary)
+    assert client.get(f"/orders/{in_replica}", params={"customer_id": "C-GET"}).status_code == 404
+
+@pytest.mark.anyio
+async def test_get_order_of_another_customer_returns_404(replicated_router, monkeypatch):
+    monkeypatch.setattr(main, "router", replicated_router)
+    order_id = await _seed_order(replicated_router.shards[0].engine, "C-OWNER")
+    await pin_to_primary("C-INTRUSO", window=60)
+
+    r = TestClient(main.app).get(f"/orders/{order_id}", params={"customer_id": "C-INTRUSO"})
+    assert r.status_code == 404
+    assert r.json()["detail"] == "Orden no encontrada"
+
+def test_get_request_status_unknown_returns_404(replicated_router, monkeypatch):
+    monkeypatch.setattr(main, "router", replicated_router)
+    r = TestClient(main.app).get("/orders/requests/no-existe", params={"customer_id": "C-X"})
+    assert r.status_code == 404
+    assert r.json()["detail"] == "Request no encontrada"
+
+@pytest.fixture
+async def broken_replica_router(test_engine, tmp_path):
+    """La réplica entrega la conexión pero se corta antes de la consulta (conexión perdida)."""
+    from sqlalchemy import event
+    broken = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'broken.db'}")
+
+    @event.listens_for(broken.sync_engine.pool, "checkout")
+    def _drop_connection(dbapi_connection, record, proxy):
+        dbapi_connection.close()
+
+    try:
+        yield ShardRouter({"shard0": test_engine}, replicas={"shard0": [broken]})
+    finally:
+        await broken.dispose()
+
+@pytest.mark.anyio
+async def test_read_session_marks_replica_down_on_dropped_connection(broken_replica_router):
+    from sqlalchemy import select
+    from sqlalchemy.exc import DBAPIError
+    from app.models import Order
+    shard = broken_replica_router.shards[0]
+
+    with pytest.raises(DBAPIError) as ex:
+        async with shard.read_session() as s:
+            await s.execute(select(Order))
+    assert ex.value.connection_invalidated
+    assert shard.replicas.healthy() == []
+
+    # la siguiente lectura ya no pasa por la réplica
+    async with shard.read_session() as s:
+        assert "replica" not in s.info
+
+@pytest.mark.anyio
+async def test_read_retries_on_primary_after_dropped_connection(broken_replica_router):
+    from sqlalchemy import select, func
+    from app.models import Order
+    shard = broken_replica_router.shards[0]
+
+    async def _count(s):
+        return await s.scalar(select(func.count()).select_from(Order))
+
+    assert await shard.read(_count) >= 0     # respondió el primario
+    assert shard.replicas.healthy() == []
+
+@pytest.mark.anyio
+async def test_query_error_on_replica_does_not_mark_it_down(test_engine, tmp_path):
+    from sqlalchemy import select
+    from sqlalchemy.exc import OperationalError
+    from app.models import Order
+    # réplica sana pero sin tablas: el error es de la consulta, no de la conexión
+    empty = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'empty.db'}")
+    shard = ShardRouter({"shard0": test_engine}, replicas={"shard0": [empty]}).shards[0]
+    try:
+        with pytest.raises(OperationalError):
+            async with shard.read_session() as s:
+                await s.execute(select(Order))
+        with pytest.raises(OperationalError):
+            await shard.read(lambda s: s.execute(select(Order)))   # sin reintento en el primario
+        assert shard.replicas.healthy() == [0]
+    finally:
+        await empty.dispose()
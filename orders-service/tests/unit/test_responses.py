@@ -0,0 +1,60 @@
+# tests/unit/test_responses.py
+import uuid
+import pytest
+from sqlalchemy import delete
+
+from app.main import _sha256, _key_hash
+from app.models import IdempotencyRequest, IdemStatus
+from app.responses import ReplayCache
+from app.schemas import CreateOrderRequest
+
+def test_replay_cache_keeps_bytes_and_evicts_lru():
+    cache = ReplayCache(max_bytes=1000)
+    cache.put("k1", "bh1", 201, {"order_id": "o1", "status": "CREATED"})
+    cache.put("k2", "bh2", 202, '{"raw":  "texto"}')
+    assert cache.get("k1").body == b'{"order_id":"o1","status":"CREATED"}'
+    assert cache.get("k2").body == b'{"raw":  "texto"}'   # texto JSON: tal cual
+
+    # k1 se leyó después que k2: al entrar k3 se desaloja k2 (el menos reciente)
+    cache.get("k1")
+    cache.put("k3", "bh3", 201, {"pad": "x" * 400})
+    assert cache.get("k2") is None
+    assert cache.get("k1") is not None
+    assert cache.size <= cache.max_bytes
+
+def test_replay_cache_skips_entries_bigger_than_budget():
+    cache = ReplayCache(max_bytes=100)
+    entry = cache.put("k", "bh", 201, {"pad": "x" * 500})
+    assert entry.status_code == 201
+    assert len(cache) == 0 and cache.size == 0
+
+@pytest.mark.anyio
+async def test_done_replay_returns_stored_status_and_body(client, test_session):
+    body = {"customer_id": "C-STORED", "items": [{"sku": "S1", "qty": 1}]}
+    idem_key = str(uuid.uuid4())
+    key_hash = _key_hash(body["customer_id"], idem_key)
+    stored = {"order_id": str(uuid.uuid4()), "status": "CREATED"}
+
+    test_session.add(IdempotencyRequest(
+        key_hash=key_hash,
+        body_hash=_sha256(CreateOrderRequest(**body).model_dump_json()),
+        status=IdemStatus.DONE,
+        status_code=201,
+        response_body=stored,
+    ))
+    await test_session.commit()
+
+    r = client.post("/orders", headers={"Idempotency-Key": idem_key}, json=body)
+    assert r.status_code == 201
+    assert r.json() == stored
+
+    # segundo replay sale de la LRU: ya no necesita la fila
+    await test_session.execute(delete(IdempotencyRequest).where(IdempotencyRequest.key_hash == key_hash))
+    await test_session.commit()
+    again = client.post("/orders", headers={"Idempotency-Key": idem_key}, json=body)
+    assert again.status_code == 201
+    assert again.content == r.content
+
+    # otro payload con la misma key no sale de la caché (aquí ya no hay fila: se encola)
+    other = {**body, "items": [{"sku": "S2", "qty": 1}]}
+    assert client.post("/orders", headers={"Idempotency-Key": idem_key}, json=other).status_code == 202
@@ -0,0 +1,108 @@
+# tests/unit/test_sharding.py
+import uuid
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import select, func
+
+import app.main as main
+import app.tasks as tasks
+from app.main import _key_hash
+from app.models import Base, IdempotencyRequest, IdemStatus, Order, OrderStatus, OutboxEvent
+from app.sharding import ShardRouter
+
+def _sqlite_urls(tmp_path, n):
+    return [f"sqlite+aiosqlite:///{tmp_path / f'shard{i}.db'}" for i in range(n)]
+
+async def _count(shard, model):
+    async with shard.sessionmaker() as s:
+        res = await s.execute(select(func.count()).select_from(model))
+        return res.scalar_one()
+
+@pytest.fixture
+async def shard_router(tmp_path):
+    router = ShardRouter.from_urls(_sqlite_urls(tmp_path, 3))
+    await router.create_all(Base.metadata)
+    try:
+        yield router
+    finally:
+        await router.dispose()
+
+def test_routing_is_deterministic_and_uses_every_shard(tmp_path):
+    router = ShardRouter.from_urls(_sqlite_urls(tmp_path, 3))
+    keys = [f"C-{i}" for i in range(300)]
+    first = [router.shard_for(k).name for k in keys]
+    assert first == [router.shard_for(k).name for k in keys]
+    assert set(first) == {"shard0", "shard1", "shard2"}
+
+def test_adding_a_shard_moves_a_minority_of_keys(tmp_path):
+    keys = [f"C-{i}" for i in range(1000)]
+    before = ShardRouter.from_urls(_sqlite_urls(tmp_path, 3))
+    after = ShardRouter.from_urls(_sqlite_urls(tmp_path, 4))
+    moved = [k for k in keys if before.shard_for(k).name != after.shard_for(k).name]
+    # las claves que se mueven solo pueden ir al shard nuevo
+    assert all(after.shard_for(k).name == "shard3" for k in moved)
+    assert len(moved) < len(keys) / 2
+
+def test_unknown_shard_raises(tmp_path):
+    router = ShardRouter.from_urls(_sqlite_urls(tmp_path, 2))
+    with pytest.raises(KeyError):
+        router.get("shard9")
+
+@pytest.mark.anyio
+async def test_order_idempotency_and_outbox_land_on_customer_shard(shard_router, monkeypatch):
+    monkeypatch.setattr(main, "router", shard_router)
+    monkeypatch.setattr(tasks, "router", shard_router)
+
+    customer_id = "C-SHARDED"
+    idem_key = str(uuid.uuid4())
+    key_hash = _key_hash(customer_id, idem_key)
+    home = shard_router.shard_for(customer_id)
+
+    r = TestClient(main.app).post(
+        "/orders",
+        headers={"Idempotency-Key": idem_key},
+        json={"customer_id": customer_id, "items": [{"sku": "S1", "qty": 1}]},
+    )
+    assert r.status_code == 202
+
+    for shard in shard_router.shards:
+        expected = 1 if shard is home else 0
+        assert await _count(shard, Order) == expected
+        assert await _count(shard, OutboxEvent) == expected
+        assert await _count(shard, IdempotencyRequest) == expected
+
+    name, args, kwargs = main.celery.calls[-1]
+    assert name == "process_outbox_event"
+    assert kwargs == {"shard": home.name}
+
+    # el worker procesa el evento en el mismo shard
+    await tasks._process(*args, **kwargs)
+    async with home.sessionmaker() as s:
+        order = (await s.execute(select(Order))).scalar_one()
+        idem = await s.get(IdempotencyRequest, key_hash)
+        assert order.status == OrderStatus.CREATED
+        assert idem.status == IdemStatus.DONE
+
+def test_idempotency_key_is_scoped_per_customer_across_shards(shard_router, monkeypatch):
+    monkeypatch.setattr(main, "router", shard_router)
+    client = TestClient(main.app)
+
+    cust_a = "C-A"
+    cust_b = next(f"C-B{i}" for i in range(100)
+                  if shard_router.shard_for(f"C-B{i}") is not shard_router.shard_for(cust_a))
+    idem_key = str(uuid.uuid4())
+    headers = {"Idempotency-Key": idem_key}
+
+    first = client.post("/orders", headers=headers, json={"customer_id": cust_a, "items": [{"sku": "A", "qty": 1}]})
+    assert first.status_code == 202
+    assert first.json()["request_id"] == _key_hash(cust_a, idem_key)
+
+    # mismo cliente, misma key, otro payload -> 409 siempre (la fila está en su shard)
+    conflict = client.post("/orders", headers=headers, json={"customer_id": cust_a, "items": [{"sku": "B", "qty": 2}]})
+    assert conflict.status_code == 409
+
+    # otro cliente con la misma key: es otra request por diseño, en su propio shard
+    other = client.post("/orders", headers=headers, json={"customer_id": cust_b, "items": [{"sku": "B", "qty": 2}]})
+    assert other.status_code == 202
+    assert other.json()["request_id"] == _key_hash(cust_b, idem_key)
+    assert other.json()["request_id"] != first.json()["request_id"]
@@ -1,18 +1,14 @@
 # tests/unit/test_tasks.py
 import uuid
 import pytest
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 import app.tasks as tasks
 from app.models import OutboxEvent, Order, OrderStatus, IdempotencyRequest, IdemStatus
 
-def _patch_sessionlocal_to_test_engine(test_engine, monkeypatch):
-    Session = async_sessionmaker(bind=test_engine, expire_on_commit=False, class_=AsyncSession)
-    monkeypatch.setattr(tasks, "SessionLocal", Session, raising=True)
+# El worker resuelve su sesión vía tasks.router, que conftest (override_db) apunta al engine de pruebas
 
 # 1) TEST SÍNCRONO -> Cubre process_outbox_event() (líneas 16–18) y early return si no hay evento
 def test_tasks_missing_event_returns_early_sync(test_engine, monkeypatch):
-    _patch_sessionlocal_to_test_engine(test_engine, monkeypatch)
     random_id = str(uuid.uuid4())
     # No hay event loop corriendo, asyncio.run() funciona y no debe lanzar
     tasks.process_outbox_event(random_id)
@@ -22,7 +18,6 @@ def test_tasks_missing_event_returns_early_sync(test_engine, monkeypatch):
 async def test_tasks_event_present_but_order_missing_returns_early(
     test_engine, test_session, monkeypatch
 ):
-    _patch_sessionlocal_to_test_engine(test_engine, monkeypatch)
 
     # ⬇️ usar UUID real en aggregate_id
     missing_order_id = uuid.uuid4()  # ✅ UUID real
@@ -47,7 +42,6 @@ async def test_tasks_event_present_but_order_missing_returns_early(
 async def test_tasks_happy_flow_updates_order_and_idempotency(
     test_engine, test_session, monkeypatch
 ):
-    _patch_sessionlocal_to_test_engine(test_engine, monkeypatch)
 
     order = Order(customer_id="C-TASK", items=[{"sku": "X1", "qty": 1}])
     test_session.add(order)
@@ -85,3 +79,79 @@ async def test_tasks_happy_flow_updates_order_and_idempotency(
     assert i.status == IdemStatus.DONE
     assert i.status_code == 201
     assert i.response_body == {"order_id": str(order.id), "status": "CREATED"}
+
+# 4) Mensaje autocontenido: solo UPDATEs condicionales, sin lecturas
+async def _seed_pending_order(test_session):
+    order = Order(customer_id="C-INLINE", items=[{"sku": "I1", "qty": 1}])
+    test_session.add(order)
+    await test_session.flush()
+    key_hash = f"kh-{uuid.uuid4().hex}"
+    test_session.add(IdempotencyRequest(key_hash=key_hash, body_hash="bh", status=IdemStatus.PENDING))
+    evt = OutboxEvent(aggregate_id=order.id, type="OrderCreated",
+                      payload={"order_id": str(order.id), "key_hash": key_hash})
+    test_session.add(evt)
+    await test_session.commit()
+    return order, evt, key_hash
+
+@pytest.mark.anyio
+async def test_tasks_inline_message_skips_reads(test_engine, test_session, monkeypatch):
+    from sqlalchemy import event
+    order, evt, key_hash = await _seed_pending_order(test_session)
+
+    statements = []
+    def _record(conn, cursor, statement, *a):
+        statements.append(statement.lstrip().split()[0].upper())
+    event.listen(test_engine.sync_engine, "before_cursor_execute", _record)
+    try:
+        await tasks._process(str(evt.event_id), message=tasks.build_message(evt))
+    finally:
+        event.remove(test_engine.sync_engine, "before_cursor_execute", _record)
+    assert statements == ["UPDATE", "UPDATE", "UPDATE"]
+
+    o = await test_session.get(Order, order.id)
+    e = await test_session.get(OutboxEvent, evt.event_id)
+    i = await test_session.get(IdempotencyRequest, key_hash)
+    for obj in (o, e, i):
+        await test_session.refresh(obj)
+    assert o.status == OrderStatus.CREATED
+    assert e.published_at is not None
+    assert i.status == IdemStatus.DONE
+    assert i.response_body == {"order_id": str(order.id), "status": "CREATED"}
+
+    # reentrega: la orden ya no está en NEW, no se toca nada más
+    statements.clear()
+    event.listen(test_engine.sync_engine, "before_cursor_execute", _record)
+    try:
+        await tasks._process(str(evt.event_id), message=tasks.build_message(evt))
+    finally:
+        event.remove(test_engine.sync_engine, "before_cursor_execute", _record)
+    assert statements == ["UPDATE"]
+
+@pytest.mark.anyio
+async def test_tasks_unknown_message_version_falls_back_to_reads(test_engine, test_session, monkeypatch):
+    order, evt, key_hash = await _seed_pending_order(test_session)
+
+    message = {**tasks.build_message(evt), "v": tasks.MESSAGE_VERSION + 1}
+    await tasks._process(str(evt.event_id), message=message)
+
+    o = await test_session.get(Order, order.id)
+    await test_session.refresh(o)
+    assert o.status == OrderStatus.CREATED
+
+def test_inline_message_is_sent_with_msgpack(client, monkeypatch):
+    import app.main as main
+    from kombu.serialization import dumps, loads, prepare_accept_content
+
+    sent = {}
+    monkeypatch.setattr(main.settings, "OUTBOX_INLINE_MESSAGES", True)
+    monkeypatch.setattr("app.main.celery.send_task", lambda name, **kw: sent.update(kw), raising=True)
+
+    r = client.post("/orders", json={"customer_id": "C-MSGPACK", "items": [{"sku": "M1", "qty": 1}]})
+    assert r.status_code == 202
+    assert sent["serializer"] == "msgpack"
+    message = sent["kwargs"]["message"]
+    assert message["v"] == tasks.MESSAGE_VERSION
+    assert message["key_hash"] == r.json()["request_id"]
+
+    content_type, encoding, data = dumps(sent["kwargs"], serializer="msgpack")
+    assert loads(data, content_type, encoding, accept=prepare_accept_content(tasks.celery.conf.accept_content)) == sent["kwargs"]
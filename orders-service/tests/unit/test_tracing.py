@@ -0,0 +1,183 @@
+# tests/unit/test_tracing.py
+import asyncio
+import json
+import os
+import uuid
+import pytest
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import app.tasks as tasks
+from app import tracing
+from app.models import OutboxEvent
+from app.tracing import Tracer, InMemoryExporter, FileExporter, inject, extract
+
+@pytest.fixture
+def spans(monkeypatch):
+    exporter = InMemoryExporter()
+    monkeypatch.setattr(tracing.tracer, "exporter", exporter)
+    monkeypatch.setattr(tracing.tracer, "sample_ratio", 1.0)
+    return exporter
+
+@pytest.fixture
+def instrumented_engine(test_engine):
+    # el engine de pruebas es de sesión: los listeners no deben quedar para los demás tests
+    tracing.instrument_engine(test_engine)
+    try:
+        yield test_engine
+    finally:
+        tracing.uninstrument_engine(test_engine)
+
+def test_traceparent_roundtrip():
+    t = Tracer()
+    with t.span("root") as span:
+        carrier = inject({})
+    ctx = extract(carrier)
+    assert ctx == span.context
+    assert extract({"traceparent": "basura"}) is None
+    assert extract({}) is None
+
+def test_sampling_ratio_and_children_inherit_decision():
+    exporter = InMemoryExporter()
+    t = Tracer(exporter=exporter, sample_ratio=0.0)
+    with t.span("root") as root:
+        with t.span("child") as child:
+            pass
+    assert not root.recording and not child.recording
+    assert child.context.trace_id == root.context.trace_id
+    assert exporter.spans == []
+
+    # el padre remoto manda sobre el ratio local
+    remote = extract({"traceparent": f"00-{'a' * 32}-{'b' * 16}-01"})
+    with t.span("consumer", parent=remote) as span:
+        pass
+    assert span.parent_id == "b" * 16
+    assert exporter.spans == [span]
+
+def test_file_exporter_writes_json_lines(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    exporter = FileExporter(str(path))
+    t = Tracer(exporter=exporter)
+    with pytest.raises(ValueError):
+        with t.span("falla", attributes={"key_hash": "kh"}):
+            raise ValueError("boom")
+    assert exporter.flush()
+    exporter.shutdown()
+    [line] = path.read_text(encoding="utf-8").splitlines()
+    data = json.loads(line)
+    assert data["name"] == "falla"
+    assert data["status"] == "ERROR"
+    assert data["attributes"] == {"key_hash": "kh"}
+
+def test_single_trace_from_request_to_worker(client, instrumented_engine, spans, monkeypatch):
+    import app.main as main
+    test_engine = instrumented_engine
+
+    trace_id = uuid.uuid4().hex
+    r = client.post(
+        "/orders",
+        headers={"Idempotency-Key": str(uuid.uuid4()), "traceparent": f"00-{trace_id}-{'1' * 16}-01"},
+        json={"customer_id": "C-TRACE", "items": [{"sku": "T1", "qty": 1}]},
+    )
+    assert r.status_code == 202
+
+    [request_span] = spans.by_name("POST /orders")
+    [tx] = spans.by_name("create_order.tx")
+    [send] = spans.by_name("celery.send_task")
+    assert request_span.context.trace_id == trace_id
+    assert tx.parent_id == request_span.context.span_id
+    assert send.parent_id == request_span.context.span_id
+    assert tx.attributes["key_hash"] == send.attributes["key_hash"]
+    assert any(s.parent_id == tx.context.span_id for s in spans.by_name("db.statement"))
+
+    # el contexto viaja en los headers de Celery y en el payload del outbox
+    name, args, kwargs = main.celery.calls[-1]
+    async def _load_event():
+        async with async_sessionmaker(bind=test_engine)() as s:
+            return await s.get(OutboxEvent, uuid.UUID(args[0]))
+    assert extract(asyncio.run(_load_event()).payload).trace_id == trace_id
+
+    # worker: mismo trace, con tiempo en cola
+    headers = {"traceparent": f"00-{trace_id}-{send.context.span_id}-01", "enqueued_at": 0}
+    spans.clear()
+    tasks.process_outbox_event.push_request(headers=headers)
+    try:
+        tasks.process_outbox_event.run(*args, **kwargs)
+    finally:
+        tasks.process_outbox_event.pop_request()
+    [worker] = spans.by_name("process_outbox_event")
+    assert worker.context.trace_id == trace_id
+    assert worker.parent_id == send.context.span_id
+    assert worker.attributes["messaging.queue_time_ms"] > 0
+    assert worker.attributes["key_hash"] == tx.attributes["key_hash"]
+
+def test_uninstrument_engine_removes_listeners(test_engine):
+    from sqlalchemy import event
+    tracing.instrument_engine(test_engine)
+    tracing.uninstrument_engine(test_engine)
+    assert not event.contains(test_engine.sync_engine, "before_cursor_execute", tracing._before_cursor_execute)
+    assert not event.contains(test_engine.sync_engine, "handle_error", tracing._handle_error)
+    tracing.uninstrument_engine(test_engine)   # idempotente
+
+def test_request_span_is_named_by_route_template(client, spans, fake_redis):
+    order_id = uuid.uuid4()
+    assert client.get(f"/orders/{order_id}", params={"customer_id": "C-X"}).status_code == 404
+    assert client.get("/no-existe").status_code == 404
+
+    [span] = spans.by_name("GET /orders/{order_id}")
+    assert span.attributes["http.route"] == "/orders/{order_id}"
+    assert span.attributes["http.target"] == f"/orders/{order_id}"
+    # sin ruta que coincida: solo el método, nunca el path crudo
+    assert [s.name for s in spans.spans if s.kind == "SERVER"][-1] == "GET"
+
+def test_file_exporter_does_not_write_inline_and_drops_when_full(tmp_path, monkeypatch):
+    import threading
+    path = tmp_path / "traces.jsonl"
+    release = threading.Event()
+    exporter = FileExporter(str(path), max_queue_size=2)
+
+    # el hilo de fondo queda bloqueado escribiendo el primer lote
+    real_to_dict = tracing.Span.to_dict
+    def _slow_to_dict(span):
+        release.wait(5)
+        return real_to_dict(span)
+    monkeypatch.setattr(tracing.Span, "to_dict", _slow_to_dict)
+
+    t = Tracer(exporter=exporter)
+    for i in range(5):
+        with t.span(f"s{i}"):
+            pass                        # end() no espera al archivo
+    assert not path.exists()
+    assert exporter.dropped >= 1        # cola acotada: se descarta en vez de bloquear
+
+    release.set()
+    assert exporter.flush()
+    exporter.shutdown()
+    names = [json.loads(l)["name"] for l in path.read_text(encoding="utf-8").splitlines()]
+    assert names[0] == "s0"
+    assert len(names) + exporter.dropped == 5
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requiere os.fork")
+def test_file_exporter_writes_from_forked_child(tmp_path):
+    # como el pool prefork de Celery: el exporter se crea en el padre y el hijo exporta
+    path = tmp_path / "traces.jsonl"
+    exporter = FileExporter(str(path))
+    t = Tracer(exporter=exporter)
+    with t.span("padre"):
+        pass
+    assert exporter.flush()
+
+    pid = os.fork()
+    if pid == 0:
+        ok = False
+        try:
+            with t.span("hijo"):
+                pass
+            ok = exporter._thread.is_alive() and exporter.flush()
+        finally:
+            os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+
+    exporter.shutdown()
+    names = sorted(json.loads(l)["name"] for l in path.read_text(encoding="utf-8").splitlines())
+    assert names == ["hijo", "padre"]